@@ -1,56 +1,106 @@
 from fastapi import FastAPI, HTTPException, Depends, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
-import re
+from functools import lru_cache
+import base64
+import binascii
+import os
 import time
-from sqlalchemy import text  # no topo do main.py
+import redis.asyncio as aioredis
+from sqlalchemy import select, func, insert, update, text, and_, or_, bindparam, literal  # no topo do main.py
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 
 # 🔹 Importa o engine e a Base do database
-from database import get_db, engine
+from database import get_db, engine, Base
 
 # 🔹 Importa APENAS os models
 import models
 from models import Acesso, RegistroFinanceiro
 
 # 🔹 Cria a aplicação
-app = FastAPI(title="API Financeira")
+app = FastAPI(title="API Financeira", default_response_class=ORJSONResponse)
 
 # ------------------ CORS ------------------
+# Origens explícitas via env (separadas por vírgula); "*" continua o padrão
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",")]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # navegador cacheia o preflight por 24h
 )
 
 # ------------------ RATE LIMIT ------------------
 RATE_LIMIT = 30  # requisições
 TIME_WINDOW = 60  # segundos
-rate_limit_store = {}  # ip -> [timestamps]
+REDIS_URL = os.getenv("REDIS_URL")  # quando definido, o limite vale para todos os workers
+
+# INCR + EXPIRE atômicos em um único round-trip (janela fixa por IP)
+_RATE_LIMIT_LUA = (
+    "local c = redis.call('INCR', KEYS[1]) "
+    "if c == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end "
+    "return c"
+)
+
+redis_client = None  # criado no startup quando REDIS_URL estiver definido
+rate_limit_store = {}  # fallback em processo: ip -> (janela, contagem)
+RATE_LIMIT_MAX_IPS = 100_000  # teto de memória do fallback
+RATE_LIMIT_SWEEP = 300  # segundos entre varreduras de IPs inativos
+_last_sweep = 0.0
+
+def _client_ip(request: Request) -> str:
+    # Atrás do proxy o client.host é o IP do proxy; usa o primeiro da lista
+    # do X-Forwarded-For e guarda em request.state para não re-parsear
+    ip = getattr(request.state, "client_ip", None)
+    if ip is None:
+        xff = request.headers.get("x-forwarded-for")
+        if xff:
+            ip = xff.split(",", 1)[0].strip()
+        else:
+            ip = request.client.host if request.client else "desconhecido"
+        request.state.client_ip = ip
+    return ip
 
-def rate_limiter(request: Request):
-    ip = request.client.host
+async def rate_limiter(request: Request):
+    ip = _client_ip(request)
     now = time.time()
-    timestamps = rate_limit_store.get(ip, [])
-    timestamps = [t for t in timestamps if now - t < TIME_WINDOW]
-    if len(timestamps) >= RATE_LIMIT:
+    janela = int(now) // TIME_WINDOW
+    if redis_client is not None:
+        key = f"rl:{ip}:{janela}"
+        count = await redis_client.eval(_RATE_LIMIT_LUA, 1, key, TIME_WINDOW)
+        if int(count) > RATE_LIMIT:
+            raise HTTPException(status_code=429, detail="Muitas requisições, tente novamente mais tarde")
+        return
+    # Sem Redis configurado, contador local por janela fixa (O(1) por requisição)
+    global _last_sweep
+    if now - _last_sweep > RATE_LIMIT_SWEEP or len(rate_limit_store) >= RATE_LIMIT_MAX_IPS:
+        # varredura periódica: descarta contadores de janelas já encerradas
+        for k, (w, _) in list(rate_limit_store.items()):
+            if w != janela:
+                del rate_limit_store[k]
+        _last_sweep = now
+    win, count = rate_limit_store.get(ip, (janela, 0))
+    if win != janela:
+        count = 0
+    if count >= RATE_LIMIT:
         raise HTTPException(status_code=429, detail="Muitas requisições, tente novamente mais tarde")
-    timestamps.append(now)
-    rate_limit_store[ip] = timestamps
+    rate_limit_store[ip] = (janela, count + 1)
 
 # ------------------ MODELS ------------------
 class AcessoOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
     id: UUID
     cpf: str
-    class Config:
-        from_attributes = True  # Pydantic V2
 
 class RegistroFinanceiroCreate(BaseModel):
     tipo: str
@@ -64,17 +114,18 @@ class RegistroFinanceiroCreate(BaseModel):
     observacao: Optional[str] = ""
 
 class RegistroFinanceiroUpdate(BaseModel):
-    tipo: Optional[str]
-    categoria: Optional[str]
-    valor: Optional[float]
-    forma_pagamento: Optional[str]
-    descricao: Optional[str]
-    data_vencimento: Optional[datetime]
-    data_liquidacao: Optional[datetime]
-    status: Optional[str]
-    observacao: Optional[str]
+    tipo: Optional[str] = None
+    categoria: Optional[str] = None
+    valor: Optional[float] = None
+    forma_pagamento: Optional[str] = None
+    descricao: Optional[str] = None
+    data_vencimento: Optional[datetime] = None
+    data_liquidacao: Optional[datetime] = None
+    status: Optional[str] = None
+    observacao: Optional[str] = None
 
 class RegistroFinanceiroOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
     id: UUID
     acesso_id: UUID
     tipo: str
@@ -89,13 +140,11 @@ class RegistroFinanceiroOut(BaseModel):
     ativo: bool
     created_at: datetime
     updated_at: datetime
-    class Config:
-        from_attributes = True
 
 # ------------------ FUNÇÕES AUXILIARES ------------------
 def aplicar_offset_limit(query, offset: int, limit: int):
-    if limit > 100:
-        limit = 100
+    offset = max(offset, 0)  # offset negativo é erro no Postgres
+    limit = min(max(limit, 0), 100)
     return query.offset(offset).limit(limit), limit
 
 def set_pagination_headers(response: Response, total: int, offset: int, limit: int, acesso_id: str):
@@ -103,17 +152,76 @@ def set_pagination_headers(response: Response, total: int, offset: int, limit: i
     response.headers["X-Offset"] = str(offset)
     response.headers["X-Limit"] = str(limit)
     response.headers["X-Acesso-ID"] = acesso_id
-    response.headers["Access-Control-Expose-Headers"] = "X-Total, X-Offset, X-Limit, X-Acesso-ID"
+    response.headers["Access-Control-Expose-Headers"] = "X-Total, X-Offset, X-Limit, X-Acesso-ID, X-Next-Cursor"
 
-def validar_cpf(cpf: str) -> bool:
-    cpf_numeros = re.sub(r"\D", "", cpf)
-    if len(cpf_numeros) != 11 or cpf_numeros == cpf_numeros[0] * 11:
+# Tabela de tradução que apaga tudo que não é dígito: um passo em C,
+# sem motor de regex (construída uma vez no import)
+_KEEP_DIGITS = str.maketrans("", "", "".join(chr(c) for c in range(256) if not chr(c).isdigit()))
+_PESOS1 = (10, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# CPFs repetidos (re-logins) resolvem no cache sem refazer a aritmética
+@lru_cache(maxsize=8192)
+def _validar_cpf_digits(cpf_numeros: str) -> bool:
+    # Dígitos Unicode ('²', '١', ...) sobrevivem à limpeza mas não são CPF
+    if len(cpf_numeros) != 11 or not cpf_numeros.isascii() or cpf_numeros == cpf_numeros[0] * 11:
         return False
-    soma1 = sum(int(cpf_numeros[i]) * (10 - i) for i in range(9))
+    d = bytes(cpf_numeros, "ascii")  # dígito i vale d[i] - 48
+    soma1 = sum((c - 48) * p for c, p in zip(d, _PESOS1))
     digito1 = (soma1 * 10 % 11) % 10
-    soma2 = sum(int(cpf_numeros[i]) * (11 - i) for i in range(10))
+    if digito1 != d[9] - 48:
+        return False
+    # Identidade: soma2 = soma1 + (soma dos 9 primeiros dígitos) + 2*digito1,
+    # dispensando a segunda rodada de multiplicações
+    soma2 = soma1 + sum(d[:9]) - 9 * 48 + 2 * digito1
     digito2 = (soma2 * 10 % 11) % 10
-    return digito1 == int(cpf_numeros[9]) and digito2 == int(cpf_numeros[10])
+    return digito2 == d[10] - 48
+
+def clean_cpf(cpf: str) -> str:
+    return cpf.translate(_KEEP_DIGITS)
+
+def validar_cpf(cpf: str) -> bool:
+    return _validar_cpf_digits(clean_cpf(cpf))
+
+# Cursor opaco de paginação keyset: base64 de "created_at_iso|id"
+def encode_cursor(created_at: datetime, registro_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{registro_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        criado_em, registro_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(criado_em), UUID(registro_id)
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+# ------------------ STATEMENTS PRÉ-MONTADOS ------------------
+# Construídos uma vez no import; cada request só liga os parâmetros
+# Só as colunas, sem hidratar objetos ORM: a listagem é read-only e o
+# payload sai direto dos Rows para o orjson
+_STMT_LIST_REG = (
+    select(
+        RegistroFinanceiro.id,
+        RegistroFinanceiro.acesso_id,
+        RegistroFinanceiro.tipo,
+        RegistroFinanceiro.categoria,
+        RegistroFinanceiro.valor,
+        RegistroFinanceiro.forma_pagamento,
+        RegistroFinanceiro.descricao,
+        RegistroFinanceiro.data_vencimento,
+        RegistroFinanceiro.data_liquidacao,
+        RegistroFinanceiro.status,
+        RegistroFinanceiro.observacao,
+        RegistroFinanceiro.ativo,
+        RegistroFinanceiro.created_at,
+        RegistroFinanceiro.updated_at,
+        func.count().over().label("total"),
+    )
+    .where(RegistroFinanceiro.acesso_id == bindparam("aid"))
+    .where(RegistroFinanceiro.ativo == True)
+    .order_by(RegistroFinanceiro.created_at.desc(), RegistroFinanceiro.id.desc())
+)
+# SELECT 1: só checa existência, sem hidratar o objeto Acesso inteiro
+_STMT_ACESSO_EXISTE = select(literal(1)).where(Acesso.id == bindparam("aid"))
+_STMT_ACESSO_POR_CPF = select(Acesso).where(Acesso.cpf == bindparam("cpf"))
 
 # ------------------ STARTUP / SHUTDOWN ------------------
 @app.on_event("startup")
@@ -122,13 +230,25 @@ async def startup_event():
     Inicializa conexões e pools do SQLAlchemy Async.
     Não crie tabelas aqui! Use Alembic para migrações.
     """
+    global redis_client
     try:
-        async with engine.connect() as conn:
-            await conn.execute(text("SELECT 1"))
+        if os.getenv("RUN_DB_INIT") == "1":
+            # Bootstrap opcional (primeiro deploy / dev); produção migra com Alembic
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            print("✅ Tabelas criadas (RUN_DB_INIT=1)")
+        else:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
         print("✅ Conexão com o banco OK")
     except Exception as e:
         print("❌ Falha ao conectar no banco:", e)
         raise
+    if REDIS_URL:
+        redis_client = aioredis.from_url(REDIS_URL)
+        print("✅ Rate limit usando Redis")
+    # Gera o schema OpenAPI uma vez; /openapi.json e /docs passam a servir do cache
+    app.openapi_schema = app.openapi()
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -136,122 +256,166 @@ async def shutdown_event():
     Fecha conexões e pools do SQLAlchemy Async.
     """
     await engine.dispose()
+    if redis_client is not None:
+        await redis_client.aclose()
     print("🔒 Conexões encerradas")
 
 
 
 # ------------------ ENDPOINT ACESSO ------------------
-@app.post("/acesso", response_model=AcessoOut)
-async def get_or_create_acesso(cpf: str, db: AsyncSession = Depends(get_db), request: Request = None):
-    if request:
-        rate_limiter(request)
-    cpf_numeros = re.sub(r"\D", "", cpf)
-    if not validar_cpf(cpf_numeros):
+@app.post("/acesso", response_model=AcessoOut, dependencies=[Depends(rate_limiter)])
+async def get_or_create_acesso(cpf: str, db: AsyncSession = Depends(get_db)):
+    cpf_numeros = clean_cpf(cpf)
+    if not _validar_cpf_digits(cpf_numeros):
         raise HTTPException(status_code=400, detail="CPF inválido.")
-    result = await db.execute(select(Acesso).where(Acesso.cpf == cpf_numeros))
-    acesso = result.scalar_one_or_none()
-    if acesso:
-        return acesso
-    novo = Acesso(cpf=cpf_numeros)
-    db.add(novo)
+    # Um único round-trip no caso novo; sem janela de corrida entre SELECT e INSERT
+    stmt = (
+        pg_insert(Acesso)
+        .values(cpf=cpf_numeros)
+        .on_conflict_do_nothing(index_elements=["cpf"])
+        .returning(Acesso)
+    )
+    acesso = (await db.execute(stmt)).scalar_one_or_none()
+    if acesso is None:
+        # CPF já cadastrado: o INSERT não retornou linha, busca a existente
+        acesso = await db.scalar(_STMT_ACESSO_POR_CPF, {"cpf": cpf_numeros})
     await db.commit()
-    await db.refresh(novo)
-    return novo
+    return acesso
 
-@app.get("/acessos", response_model=List[AcessoOut])
+@app.get("/acessos", response_model=List[AcessoOut], dependencies=[Depends(rate_limiter)])
 async def listar_acessos(response: Response, offset: int = 0, limit: int = 10,
-                         db: AsyncSession = Depends(get_db), request: Request = None):
-    if request:
-        rate_limiter(request)
-    result = await db.execute(select(Acesso))
-    query = result.scalars()
-    total = await db.execute(select(Acesso))
-    total_count = len(total.scalars().all())
-    # Offset e limit manual
-    query_list = query.all()[offset:offset+limit]
-    set_pagination_headers(response, total_count, offset, limit, acesso_id="")
-    return query_list
+                         db: AsyncSession = Depends(get_db)):
+    # count(*) OVER () traz página e total no mesmo round-trip
+    stmt, limit = aplicar_offset_limit(
+        select(Acesso, func.count().over().label("total")), offset, limit
+    )
+    rows = (await db.execute(stmt)).all()
+    total = rows[0].total if rows else 0
+    acessos = [r[0] for r in rows]
+    set_pagination_headers(response, total, offset, limit, acesso_id="")
+    return acessos
 
 # ------------------ REGISTROS FINANCEIROS ------------------
-@app.get("/registros", response_model=List[RegistroFinanceiroOut])
+@app.get("/registros", response_model=None, dependencies=[Depends(rate_limiter)])
 async def listar_registros(
-    acesso_id: str,
-    response: Response,
+    acesso_id: UUID,
     offset: int = 0,
     limit: int = 10,
-    db: AsyncSession = Depends(get_db),
-    request: Request = None
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    if request:
-        rate_limiter(request)
-    result = await db.execute(
-        select(RegistroFinanceiro)
-        .where(RegistroFinanceiro.acesso_id == str(acesso_id))
-        .where(RegistroFinanceiro.ativo == True)
-    )
-    registros = result.scalars().all()
-    total = len(registros)
-    registros_pag = registros[offset:offset+limit]
-    set_pagination_headers(response, total, offset, limit, acesso_id)
-    return registros_pag
-
-@app.post("/registros", response_model=RegistroFinanceiroOut)
-async def criar_registro(acesso_id: str, registro: RegistroFinanceiroCreate,
-                         db: AsyncSession = Depends(get_db), request: Request = None):
-    if request:
-        rate_limiter(request)
-    result = await db.execute(select(Acesso).where(Acesso.id == acesso_id))
-    acesso = result.scalar_one_or_none()
-    if not acesso:
+    # count(*) OVER () traz página e total no mesmo round-trip
+    stmt = _STMT_LIST_REG
+    if after is not None:
+        # keyset: continua de onde o cursor parou, sem custo de OFFSET
+        criado_em, ultimo_id = decode_cursor(after)
+        stmt = stmt.where(
+            or_(
+                RegistroFinanceiro.created_at < criado_em,
+                and_(RegistroFinanceiro.created_at == criado_em, RegistroFinanceiro.id < ultimo_id),
+            )
+        )
+        offset = 0
+    stmt, limit = aplicar_offset_limit(stmt, offset, limit)
+    rows = (await db.execute(stmt, {"aid": acesso_id})).mappings().all()
+    total = rows[0]["total"] if rows else 0
+    itens = [dict(r) for r in rows]
+    for item in itens:
+        del item["total"]
+    response = ORJSONResponse(itens)
+    set_pagination_headers(response, total, offset, limit, str(acesso_id))
+    if len(itens) == limit and itens:
+        response.headers["X-Next-Cursor"] = encode_cursor(itens[-1]["created_at"], itens[-1]["id"])
+    return response
+
+@app.post("/registros", response_model=RegistroFinanceiroOut, dependencies=[Depends(rate_limiter)])
+async def criar_registro(acesso_id: UUID, registro: RegistroFinanceiroCreate,
+                         db: AsyncSession = Depends(get_db)):
+    existe = await db.scalar(_STMT_ACESSO_EXISTE, {"aid": acesso_id})
+    if not existe:
         raise HTTPException(status_code=404, detail="Acesso não encontrado")
-    novo_registro = RegistroFinanceiro(acesso_id=acesso_id, **registro.dict())
+    # INSERT ... RETURNING devolve a linha com os defaults do banco,
+    # dispensando o refresh (um round-trip a menos por POST)
+    stmt = (
+        insert(RegistroFinanceiro)
+        .values(acesso_id=acesso_id, **registro.model_dump())
+        .returning(RegistroFinanceiro)
+    )
     try:
-        db.add(novo_registro)
+        novo_registro = (await db.execute(stmt)).scalar_one()
         await db.commit()
-        await db.refresh(novo_registro)
     except SQLAlchemyError as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao criar registro: {str(e)}")
     return novo_registro
 
-@app.put("/registros/{registro_id}", response_model=RegistroFinanceiroOut)
+@app.post("/registros/bulk", response_model=List[RegistroFinanceiroOut], dependencies=[Depends(rate_limiter)])
+async def criar_registros_em_lote(acesso_id: UUID, registros: List[RegistroFinanceiroCreate],
+                                  db: AsyncSession = Depends(get_db)):
+    existe = await db.scalar(_STMT_ACESSO_EXISTE, {"aid": acesso_id})
+    if not existe:
+        raise HTTPException(status_code=404, detail="Acesso não encontrado")
+    if not registros:
+        return []
+    # executemany em lote (insertmanyvalues): um INSERT multi-linha com RETURNING,
+    # em vez de um round-trip por registro
+    valores = [{"acesso_id": acesso_id, **r.model_dump()} for r in registros]
+    try:
+        criados = (await db.execute(insert(RegistroFinanceiro).returning(RegistroFinanceiro), valores)).scalars().all()
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao criar registros: {str(e)}")
+    return criados
+
+@app.put("/registros/{registro_id}", response_model=RegistroFinanceiroOut, dependencies=[Depends(rate_limiter)])
 async def alterar_registro(registro_id: UUID, registro_update: RegistroFinanceiroUpdate,
-                           db: AsyncSession = Depends(get_db), request: Request = None):
-    if request:
-        rate_limiter(request)
-    result = await db.execute(
-        select(RegistroFinanceiro)
-        .where(RegistroFinanceiro.id == str(registro_id))
+                           db: AsyncSession = Depends(get_db)):
+    valores = registro_update.model_dump(exclude_unset=True)
+    if not valores:
+        # nada a alterar: devolve o registro como está
+        result = await db.execute(
+            select(RegistroFinanceiro)
+            .where(RegistroFinanceiro.id == registro_id)
+            .where(RegistroFinanceiro.ativo == True)
+        )
+        registro = result.scalar_one_or_none()
+        if not registro:
+            raise HTTPException(status_code=404, detail="Registro não encontrado")
+        return registro
+    # Um único UPDATE ... RETURNING: sem SELECT prévio nem refresh depois
+    stmt = (
+        update(RegistroFinanceiro)
+        .where(RegistroFinanceiro.id == registro_id)
         .where(RegistroFinanceiro.ativo == True)
+        .values(**valores)
+        .returning(RegistroFinanceiro)
     )
-    registro = result.scalar_one_or_none()
-    if not registro:
-        raise HTTPException(status_code=404, detail="Registro não encontrado")
-    for key, value in registro_update.dict(exclude_unset=True).items():
-        setattr(registro, key, value)
-    registro.updated_at = datetime.utcnow()
     try:
+        registro = (await db.execute(stmt)).scalar_one_or_none()
+        if not registro:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Registro não encontrado")
         await db.commit()
-        await db.refresh(registro)
     except SQLAlchemyError as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar registro: {str(e)}")
     return registro
 
-@app.delete("/registros/{registro_id}", response_model=dict)
-async def deletar_registro(registro_id: UUID, db: AsyncSession = Depends(get_db), request: Request = None):
-    if request:
-        rate_limiter(request)
-    result = await db.execute(
-        select(RegistroFinanceiro)
-        .where(RegistroFinanceiro.id == str(registro_id))
+@app.delete("/registros/{registro_id}", response_model=dict, dependencies=[Depends(rate_limiter)])
+async def deletar_registro(registro_id: UUID, db: AsyncSession = Depends(get_db)):
+    # Um único UPDATE ... RETURNING já traz o updated_at carimbado pelo banco
+    stmt = (
+        update(RegistroFinanceiro)
+        .where(RegistroFinanceiro.id == registro_id)
         .where(RegistroFinanceiro.ativo == True)
+        .values(ativo=False)
+        .returning(RegistroFinanceiro)
     )
-    registro = result.scalar_one_or_none()
+    registro = (await db.execute(stmt)).scalar_one_or_none()
     if not registro:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Registro não encontrado")
-    registro.ativo = False
-    registro.updated_at = datetime.utcnow()
     await db.commit()
     return {
         "detail": f"Registro {registro_id} desativado com sucesso",
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy import String, Float, DateTime, Boolean, CheckConstraint, ForeignKey, Index, Uuid, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from database import Base
 from datetime import datetime
@@ -6,18 +6,32 @@ import uuid
 
 class Acesso(Base):
     __tablename__ = "acessos"
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    # A aplicação só grava CPF já limpo; o banco garante o formato
+    __table_args__ = (
+        CheckConstraint("cpf ~ '^[0-9]{11}$'", name="ck_acessos_cpf_digits"),
+    )
+    # uuid nativo (16 bytes): índice menor e comparação binária, em vez de 36 chars
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, default=uuid.uuid4)
     cpf: Mapped[str] = mapped_column(String, nullable=False, unique=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    registros: Mapped[list["RegistroFinanceiro"]] = relationship("RegistroFinanceiro", back_populates="acesso")
+    # lazy="raise": sob AsyncSession o lazy load implícito viraria N+1 (ou
+    # MissingGreenlet); quem precisar da coleção usa selectinload na consulta
+    registros: Mapped[list["RegistroFinanceiro"]] = relationship(
+        "RegistroFinanceiro", back_populates="acesso", lazy="raise"
+    )
 
 
 class RegistroFinanceiro(Base):
     __tablename__ = "registros_financeiros"
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    acesso_id: Mapped[str] = mapped_column(String(36), ForeignKey("acessos.id"), nullable=False)
+    # Todas as consultas quentes filtram por acesso_id + ativo e ordenam
+    # por created_at desc (paginação keyset)
+    __table_args__ = (
+        Index("ix_reg_acesso_ativo_created", "acesso_id", "ativo", "created_at"),
+    )
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, default=uuid.uuid4)
+    acesso_id: Mapped[uuid.UUID] = mapped_column(Uuid, ForeignKey("acessos.id"), nullable=False)
     tipo: Mapped[str] = mapped_column(String, nullable=False)
     categoria: Mapped[str] = mapped_column(String, nullable=False)
     valor: Mapped[float] = mapped_column(Float, nullable=False)
@@ -28,7 +42,7 @@ class RegistroFinanceiro(Base):
     status: Mapped[str] = mapped_column(String, nullable=False, default="pendente")
     observacao: Mapped[str] = mapped_column(String, default="", nullable=True)
     ativo: Mapped[bool] = mapped_column(Boolean, default=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    acesso: Mapped["Acesso"] = relationship("Acesso", back_populates="registros")
+    acesso: Mapped["Acesso"] = relationship("Acesso", back_populates="registros", lazy="raise")